@@ -1,17 +1,19 @@
-import os
-import time
 import json
-import base64
+from concurrent.futures import wait
 
 import streamlit as st
-import pandas as pd
-import folium
+import streamlit.components.v1 as components
 import numpy as np
-from groq import Groq
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
-from streamlit_folium import st_folium
-from sklearn.cluster import KMeans
+
+from primecore.core import (
+    GROQ_API_KEY,
+    MODELS,
+    cluster_route,
+    geocode_places,
+    get_itinerary_ai,
+    prefetch_geocodes,
+    total_route_distance,
+)
 
 # =========================================================
 # CONFIG
@@ -22,18 +24,20 @@ st.set_page_config(
     page_icon="🚀",
 )
 
-for key in ["trip_plan", "trip_df", "distance"]:
-    if key not in st.session_state:
-        st.session_state[key] = None
+RESULT_KEYS = ("trip_plan", "trip_route", "distance")
+INPUT_KEYS = ("origin", "dest", "days", "members", "theme", "speed")
+
+for key in RESULT_KEYS:
+    st.session_state.setdefault(key, None)
 
 # =========================================================
 # CSS
 # =========================================================
-st.markdown("""
+CSS = """
 <style>
 .stApp {
     background: linear-gradient(rgba(0,0,0,.78), rgba(0,0,0,.78)),
-    url(https://images.unsplash.com/photo-1507525428034-b723cf961d3e);
+    url(https://images.unsplash.com/photo-1507525428034-b723cf961d3e?w=1920&q=70&auto=format&fit=crop);
     background-size: cover;
     background-attachment: fixed;
 }
@@ -44,99 +48,78 @@ st.markdown("""
     border-radius: 18px;
     margin-bottom: 14px;
 }
+.stat-row { display:flex; gap:14px; }
+.stat-row .stat-box { flex:1; }
 a { color:#00d4ff !important; }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # =========================================================
 # HEADER
 # =========================================================
-st.markdown("""
+HEADER_HTML = """
 <h1 style="color:#00d4ff;">PRIMECORE</h1>
 <p style="letter-spacing:4px;color:#aaa;">JOURNEY ARCHITECT</p>
-""", unsafe_allow_html=True)
-
-# =========================================================
-# GROQ CLIENT
-# =========================================================
-GROQ_API_KEY = os.getenv("GROQ_API_KEY", st.secrets.get("GROQ_API_KEY", ""))
-client = Groq(api_key=GROQ_API_KEY)
-
-# =========================================================
-# AI CORE
-# =========================================================
-def get_itinerary_ai(origin, dest, days, members, theme):
-    prompt = f"""
-You are an elite travel AI.
-
-Trip:
-Origin: {origin}
-Destination: {dest}
-Days: {days}
-People: {members}
-Theme: {theme}
-
-Return ONLY valid JSON:
-
-{{
- "totalbudget": "number",
- "travelmode": "string",
- "weather": "2 line summary",
- "itinerary": {{"Day 1":"...", "Day 2":"..."}},
- "places":[{{"name":"", "info":"5 lines", "time":""}}],
- "restaurants":[{{"name":"","specialty":"","link":""}}],
- "hotels":[{{"name":"","tier":"","price":"","link":""}}],
- "mapcoords":["place1","place2","place3"]
-}}
 """
-    chat = client.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[{"role": "user", "content": prompt}],
-        response_format={"type": "json_object"},
-    )
-    return json.loads(chat.choices[0].message.content)
 
-# =========================================================
-# GEO + ML
-# =========================================================
-def geocode_places(places):
-    geo = Nominatim(user_agent="primecore2025")
-    data = []
-    for p in places:
-        try:
-            time.sleep(1)
-            loc = geo.geocode(p)
-            if loc:
-                data.append({"name": p, "lat": loc.latitude, "lon": loc.longitude})
-        except:
-            pass
-    return pd.DataFrame(data)
-
-def cluster_route(df, days):
-    if df is None or df.empty:
-        return df
-    k = min(days, len(df))
-    km = KMeans(n_clusters=k, random_state=42, n_init="auto")
-    df["cluster"] = km.fit_predict(df[["lat","lon"]])
-    return df.sort_values("cluster")
+# Styles and header go out as one element, so each rerun sends one delta.
+st.markdown(CSS + HEADER_HTML, unsafe_allow_html=True)
+
+# =========================================================
+# MAP
+# =========================================================
+@st.cache_data(show_spinner=False, max_entries=64)
+def route_map_html(lats, lons, names, route_days):
+    # Rendering the folium tree is the slow part, so do it once per distinct
+    # route. st.cache_data hashes the arrays by their bytes, and the day
+    # labels are part of the key because they show up in the popups.
+    import folium
+
+    center = [float(lats.mean()), float(lons.mean())]
+    m = folium.Map(location=center, zoom_start=4)
+    path = np.column_stack([lats, lons]).tolist()
+    folium.PolyLine(path, color="#00d4ff", weight=5, opacity=0.8).add_to(m)
+    # Rows arrive sorted by day, so each day is one contiguous run; give each
+    # its own toggleable layer.
+    names = np.asarray(names, dtype=object)
+    cuts = np.flatnonzero(np.diff(route_days)) + 1
+    for idx in np.split(np.arange(len(route_days)), cuts):
+        day = route_days[idx[0]]
+        layer = folium.FeatureGroup(name=f"Day {day}")
+        for lat, lon, name in zip(lats[idx], lons[idx], names[idx]):
+            layer.add_child(folium.Marker([lat, lon], popup=f"{name} (Day {day})"))
+        layer.add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m.get_root().render()
+
+def embed_map(html, height=500):
+    # Read-only map: a static embed has no Python <-> JS state sync.
+    # components.html is deprecated from Streamlit 1.65 in favour of
+    # st.iframe; keep it for the older releases requirements.txt allows.
+    if hasattr(st, "iframe"):
+        st.iframe(html, height=height)
+    else:
+        components.html(html, height=height, width=1100)
 
 # =========================================================
 # INPUT UI
 # =========================================================
 c1,c2,c3,c4 = st.columns(4)
 with c1:
-    origin = st.text_input("Origin", "Mumbai, India")
+    origin = st.text_input("Origin", "Mumbai, India", key="origin")
 with c2:
-    dest = st.text_input("Destination", "Zurich, Switzerland")
+    dest = st.text_input("Destination", "Zurich, Switzerland", key="dest")
 with c3:
-    days = st.number_input("Days",1,30,4)
+    days = st.number_input("Days",1,30,4, key="days")
 with c4:
-    members = st.number_input("People",1,20,2)
+    members = st.number_input("People",1,20,2, key="members")
 
 theme = st.selectbox(
     "Trip Style",
-    ["Luxury", "Adventure", "Cultural", "Budget", "Romantic"]
+    ["Luxury", "Adventure", "Cultural", "Budget", "Romantic"],
+    key="theme",
 )
+speed = st.radio("Speed vs Quality", list(MODELS), horizontal=True, key="speed")
 
 # =========================================================
 # EXECUTE
@@ -145,61 +128,90 @@ if st.button("🚀 BUILD MY TRIP"):
     if not GROQ_API_KEY:
         st.error("Groq API Key missing.")
     else:
-        with st.spinner("Architecting your journey..."):
-            plan = get_itinerary_ai(origin,dest,days,members,theme)
-            st.session_state.trip_plan = plan
-
-            df = geocode_places([origin]+plan["mapcoords"]+[dest])
-            df = cluster_route(df, days)
-            st.session_state.trip_df = df
-
-            if len(df) >= 2:
-                st.session_state.distance = int(
-                    geodesic(
-                        (df.lat.iloc[0], df.lon.iloc[0]),
-                        (df.lat.iloc[-1], df.lon.iloc[-1])
-                    ).km
+        with st.status("Architecting your journey...", expanded=True) as status:
+            # Origin and destination don't depend on the plan, so look them
+            # up while the LLM is still generating.
+            endpoints = prefetch_geocodes([origin, dest])
+            preview = st.empty()
+            plan = get_itinerary_ai(
+                origin, dest, days, members, theme, MODELS[speed], preview, status
+            )
+            if plan is None:
+                status.update(label="Planning failed", state="error")
+                st.error(
+                    "The itinerary was cut off before it finished. "
+                    "Try again, or plan fewer days."
                 )
+            else:
+                st.session_state.trip_plan = plan
+
+                status.update(label="Mapping your route...")
+                wait(endpoints)
+                # The model sometimes returns objects or lists here; only place
+                # names can be geocoded.
+                stops = [p for p in plan.get("mapcoords", []) if isinstance(p, str)]
+                route, (has_origin, has_dest) = geocode_places([origin]+stops+[dest])
+                route = cluster_route(route, days, has_origin, has_dest)
+                st.session_state.trip_route = route
+
+                if len(route) >= 2:
+                    st.session_state.distance = int(total_route_distance(route))
+                status.update(label="Trip ready", state="complete", expanded=False)
 
 # =========================================================
 # OUTPUT
 # =========================================================
-if st.session_state.trip_plan:
-    p = st.session_state.trip_plan
-    df = st.session_state.trip_df
-
-    st.markdown("## 📊 Trip Analytics")
-    a,b,c,d = st.columns(4)
-    a.metric("Distance (km)", st.session_state.distance)
-    b.metric("Budget ($)", p["totalbudget"])
-    c.metric("Mode", p["travelmode"])
-    d.metric("Per Day ($)", round(float(p["totalbudget"])/days,2))
+@st.fragment
+def render_output(p, route, distance, days):
+    # Widgets in here (the download button) rerun only this fragment, not
+    # the inputs, the build step and everything above.
+    stats = [
+        ("Distance (km)", distance),
+        ("Budget ($)", p.get("totalbudget", 0)),
+        ("Mode", p.get("travelmode", "N/A")),
+        ("Per Day ($)", round(float(p.get("totalbudget", 0))/days,2)),
+    ]
+    stat_boxes = "".join(
+        f"<div class='stat-box'><small>{label}</small><h3>{value}</h3></div>"
+        for label, value in stats
+    )
+    st.markdown(
+        f"<h2>📊 Trip Analytics</h2><div class='stat-row'>{stat_boxes}</div>",
+        unsafe_allow_html=True,
+    )
 
     st.info(f"🌦️ Weather Insight: {p.get('weather','N/A')}")
 
     tabs = st.tabs(["📅 Plan","📍 Places","🍽️ Stay & Food","🧠 Smart Map"])
 
+    # One st.markdown per tab: each call is a separate frontend delta.
     with tabs[0]:
-        for d,txt in p["itinerary"].items():
-            st.markdown(f"<div class='card'><b>{d}</b><br>{txt}</div>", unsafe_allow_html=True)
+        st.markdown("".join(
+            f"<div class='card'><b>{d}</b><br>{txt}</div>"
+            for d,txt in p.get("itinerary", {}).items()
+        ), unsafe_allow_html=True)
 
     with tabs[1]:
-        for pl in p["places"]:
-            st.markdown(f"<div class='card'><h4>{pl['name']}</h4>{pl['info']}<br><b>Best:</b> {pl['time']}</div>", unsafe_allow_html=True)
+        st.markdown("".join(
+            f"<div class='card'><h4>{pl['name']}</h4>{pl['info']}<br><b>Best:</b> {pl['time']}</div>"
+            for pl in p.get("places", [])
+        ), unsafe_allow_html=True)
 
     with tabs[2]:
-        for r in p["restaurants"]:
-            st.markdown(f"<div class='card'><b>{r['name']}</b><br>{r['specialty']}<br><a href='{r['link']}' target='_blank'>Visit</a></div>", unsafe_allow_html=True)
-        for h in p["hotels"]:
-            st.markdown(f"<div class='card'><b>{h['name']}</b><br>{h['tier']} • {h['price']}<br><a href='{h['link']}' target='_blank'>Book</a></div>", unsafe_allow_html=True)
+        st.markdown("".join(
+            [f"<div class='card'><b>{r['name']}</b><br>{r['specialty']}<br><a href='{r['link']}' target='_blank'>Visit</a></div>"
+             for r in p.get("restaurants", [])]
+            + [f"<div class='card'><b>{h['name']}</b><br>{h['tier']} • {h['price']}<br><a href='{h['link']}' target='_blank'>Book</a></div>"
+               for h in p.get("hotels", [])]
+        ), unsafe_allow_html=True)
 
     with tabs[3]:
-        if df is not None and not df.empty:
-            m = folium.Map(location=[df.lat.mean(), df.lon.mean()], zoom_start=4)
-            folium.PolyLine(list(zip(df.lat, df.lon))).add_to(m)
-            for _,r in df.iterrows():
-                folium.Marker([r.lat,r.lon], popup=r.name).add_to(m)
-            st_folium(m, height=500, width=1100)
+        if route is not None and len(route):
+            html = route_map_html(
+                route["lat"], route["lon"], tuple(route["name"]),
+                route["cluster"] + 1,
+            )
+            embed_map(html)
 
     st.download_button(
         "📥 Download Trip JSON",
@@ -207,7 +219,21 @@ if st.session_state.trip_plan:
         file_name="primecore_trip.json"
     )
 
+if st.session_state.trip_plan:
+    render_output(
+        st.session_state.trip_plan, st.session_state.trip_route,
+        st.session_state.distance, days,
+    )
+
 # =========================================================
 # RESET
 # =========================================================
-st.sidebar.button("🔄 Reset", on_click=lambda: st.session_state.clear())
+def reset_trip():
+    # Drop only what this app owns. Removing a widget's key puts it back to its
+    # default; Streamlit's own bookkeeping is left alone.
+    for key in INPUT_KEYS:
+        st.session_state.pop(key, None)
+    for key in RESULT_KEYS:
+        st.session_state[key] = None
+
+st.sidebar.button("🔄 Reset", on_click=reset_trip)
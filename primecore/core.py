@@ -0,0 +1,421 @@
+import os
+import re
+import time
+import json
+import hashlib
+import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import streamlit as st
+import diskcache
+import numpy as np
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# =========================================================
+# GROQ CLIENT
+# =========================================================
+GROQ_API_KEY = os.getenv("GROQ_API_KEY", st.secrets.get("GROQ_API_KEY", ""))
+
+@st.cache_resource
+def groq_client(api_key):
+    # One client (and HTTP/2 connection pool) per process and key, not per
+    # rerun; a rotated key gets a fresh client instead of the stale one.
+    # groq (and httpx under it) is only imported once a trip is requested.
+    import httpx
+    from groq import Groq
+
+    http_client = httpx.Client(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+    )
+    return Groq(api_key=api_key, http_client=http_client)
+
+# =========================================================
+# DISK CACHE
+# =========================================================
+DISK_CACHE_TTL = 30 * 24 * 60 * 60
+
+@st.cache_resource
+def disk_cache():
+    # Survives server restarts and redeploys, unlike the in-process caches.
+    return diskcache.Cache("./.trip_cache", size_limit=2**30)
+
+# =========================================================
+# AI CORE
+# =========================================================
+MODELS = {
+    "Quality (70B)": "llama-3.3-70b-versatile",
+    "Quick draft (8B)": "llama-3.1-8b-instant",
+}
+
+TRIP_SCHEMA = re.sub(r"\s+", " ", textwrap.dedent("""
+    {{"totalbudget":"number","travelmode":"string","weather":"2 line summary",
+    "itinerary":{{"Day 1":"...","Day 2":"..."}},
+    "places":[{{"name":"","info":"5 lines","time":""}}],
+    "restaurants":[{{"name":"","specialty":"","link":""}}],
+    "hotels":[{{"name":"","tier":"","price":"","link":""}}],
+    "mapcoords":["place1","place2","place3"]}}
+""")).strip()
+PROMPT_TEMPLATE = (
+    "Travel planner. Trip: {origin} to {dest}, {days} days, {members} people, "
+    "{theme} style. Reply with JSON only: " + TRIP_SCHEMA
+)
+
+TEMPLATE_HASH = hashlib.sha256(PROMPT_TEMPLATE.encode()).hexdigest()
+
+def normalize_place(text):
+    return " ".join(text.replace(",", ", ").split()).lower()
+
+PLAN_TTL = 24 * 60 * 60
+PLAN_MAX_ENTRIES = 512
+DAY_PATTERN = re.compile(r'"(Day \d+)"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+@st.cache_resource
+def _plan_store():
+    # Process-wide {key: (expires_at, raw_json)}. st.cache_data can't wrap the
+    # call because streaming writes into a placeholder owned by the caller.
+    # Every session shares it, so writes and evictions go through the lock.
+    return {}, threading.Lock()
+
+def max_tokens_for(days):
+    # Fixed sections (places, restaurants, hotels) plus one itinerary entry
+    # per day.
+    return min(8192, 2048 + 128 * int(days))
+
+def _stream_plan(prompt, model, max_tokens, placeholder=None, status=None):
+    stream = groq_client(GROQ_API_KEY).chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        response_format={"type": "json_object"},
+        temperature=0.2,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    buf = []
+    chars = 0
+    last_paint = 0.0
+    finish = None
+    for chunk in stream:
+        choice = chunk.choices[0]
+        finish = choice.finish_reason or finish
+        delta = choice.delta.content
+        if not delta:
+            continue
+        buf.append(delta)
+        chars += len(delta)
+        if time.monotonic() - last_paint <= 0.15:
+            continue
+        if status is not None:
+            status.update(label=f"Generating itinerary... {chars:,} chars")
+        if placeholder is not None:
+            days_so_far = DAY_PATTERN.findall("".join(buf))
+            if days_so_far:
+                placeholder.markdown(
+                    "\n\n".join(f"**{d}** {txt}" for d, txt in days_so_far)
+                )
+        last_paint = time.monotonic()
+    if placeholder is not None:
+        placeholder.empty()
+    return "".join(buf), finish
+
+def get_itinerary_ai(origin, dest, days, members, theme, model,
+                     placeholder=None, status=None):
+    # Returns None if the model ran out of tokens even after a retry.
+    prompt = PROMPT_TEMPLATE.format(
+        origin=origin.strip(), dest=dest.strip(),
+        days=int(days), members=int(members), theme=theme,
+    )
+    # Key on the normalised inputs so casing and spacing still hit the cache;
+    # the template hash makes prompt edits invalidate old plans.
+    key = hashlib.sha256(json.dumps([
+        model, TEMPLATE_HASH, normalize_place(origin), normalize_place(dest),
+        int(days), int(members), theme,
+    ]).encode()).hexdigest()
+    store, lock = _plan_store()
+    hit = store.get(key)
+    if hit and hit[0] > time.time():
+        return json.loads(hit[1])
+
+    raw = disk_cache().get(key)
+    if raw is None:
+        max_tokens = max_tokens_for(days)
+        raw, finish = _stream_plan(prompt, model, max_tokens, placeholder, status)
+        if finish == "length":
+            # Cut off mid-JSON; try once more with twice the room.
+            raw, finish = _stream_plan(
+                prompt, model, 2 * max_tokens, placeholder, status
+            )
+        if finish == "length":
+            return None
+        plan = json.loads(raw)
+        disk_cache().set(key, raw, expire=DISK_CACHE_TTL)
+    else:
+        plan = json.loads(raw)
+    with lock:
+        store.pop(key, None)
+        store[key] = (time.time() + PLAN_TTL, raw)
+        while len(store) > PLAN_MAX_ENTRIES:
+            store.pop(next(iter(store)))
+    return plan
+
+# =========================================================
+# GEO + ML
+# =========================================================
+@st.cache_resource
+def rate_limited_geocoder():
+    # One Nominatim session per process. The RateLimiter is thread-safe, so
+    # the 1 req/s policy holds across all workers and sessions.
+    from geopy.adapters import RequestsAdapter
+    from geopy.extra.rate_limiter import RateLimiter
+    from geopy.geocoders import Nominatim
+
+    geolocator = Nominatim(
+        user_agent="primecore2025",
+        adapter_factory=partial(RequestsAdapter, pool_connections=4, pool_maxsize=4),
+    )
+    return RateLimiter(
+        geolocator.geocode, min_delay_seconds=1, max_retries=2,
+        swallow_exceptions=False,
+    )
+
+_MISS = object()
+
+def _geocode_live(query):
+    # Misses are cached as None, so a sentinel marks an absent entry.
+    key = f"geo:{query}"
+    point = disk_cache().get(key, default=_MISS)
+    if point is not _MISS:
+        return point
+    loc = rate_limited_geocoder()(query)
+    point = (loc.latitude, loc.longitude) if loc else None
+    disk_cache().set(key, point, expire=DISK_CACHE_TTL)
+    return point
+
+@st.cache_data(ttl=DISK_CACHE_TTL, show_spinner=False)
+def _geocode_one(query):
+    return _geocode_live(query)
+
+def _safe_geocode(query):
+    try:
+        return _geocode_one(query)
+    except Exception:
+        return None
+
+def _geocode_pool(jobs):
+    # Workers need the script run context to read st.cache_data.
+    return ThreadPoolExecutor(
+        max_workers=max(1, min(4, jobs)),
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    )
+
+def prefetch_geocodes(places):
+    # Results land in the geocode caches; wait() on the futures before reading.
+    ex = _geocode_pool(len(places))
+    futures = [ex.submit(_safe_geocode, p) for p in places]
+    ex.shutdown(wait=False)
+    return futures
+
+# One row per stop, in travel order.
+ROUTE_DTYPE = np.dtype([
+    ("name", object), ("lat", np.float64), ("lon", np.float64),
+    ("cluster", np.int32),
+])
+
+def geocode_places(places):
+    # Returns the route and whether places[0] and places[-1] (origin and
+    # destination) resolved. Landmarks often repeat them; look each up once.
+    unique = list(dict.fromkeys(places))
+    with _geocode_pool(len(unique)) as ex:
+        found = dict(zip(unique, ex.map(_safe_geocode, unique)))
+    # Fill rows in place; stops that failed to geocode are masked out.
+    route = np.zeros(len(places), dtype=ROUTE_DTYPE)
+    keep = np.zeros(len(places), dtype=bool)
+    for i, p in enumerate(places):
+        point = found[p]
+        if point:
+            route["name"][i] = p
+            route["lat"][i], route["lon"][i] = point
+            keep[i] = True
+    return route[keep], (bool(keep[0]), bool(keep[-1]))
+
+EARTH_RADIUS_KM = 6371.0088  # IUGG mean radius
+
+def _haversine(phi1, phi2, dphi, dlam):
+    # Great-circle distance from latitudes and deltas in radians.
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def route_legs_km(route):
+    # Length of every consecutive leg; radians are converted once.
+    lat, lon = np.radians(route["lat"]), np.radians(route["lon"])
+    return _haversine(lat[:-1], lat[1:], np.diff(lat), np.diff(lon))
+
+def total_route_distance(route):
+    return float(route_legs_km(route).sum())
+
+def _assign_nearest(lat, lon, clat, clon, labels):
+    # Nearest-centroid step; returns whether any label moved.
+    changed = False
+    for i in range(lat.shape[0]):
+        best = 0
+        best_d = 1e30  # finite: fastmath lets LLVM assume no infinities
+        for c in range(clat.shape[0]):
+            dx = lat[i] - clat[c]
+            dy = lon[i] - clon[c]
+            d = dx * dx + dy * dy
+            if d < best_d:
+                best_d = d
+                best = c
+        if labels[i] != best:
+            labels[i] = best
+            changed = True
+    return changed
+
+def _kmeans2d(lat, lon, k, iters):
+    # Lloyd's algorithm specialised for (lat, lon): d=2 is unrolled by hand.
+    n = lat.shape[0]
+
+    # Seed from evenly strided stops (places come roughly in travel order),
+    # skipping repeats so every cluster starts on a distinct point; top up
+    # from the remaining stops if the strided pass runs short.
+    step = max(1, n // k)
+    seeds = np.empty(k, np.int64)
+    m = 0
+    for stride in (step, 1):
+        for i in range(0, n, stride):
+            if m == k:
+                break
+            fresh = True
+            for c in range(m):
+                if lat[i] == lat[seeds[c]] and lon[i] == lon[seeds[c]]:
+                    fresh = False
+                    break
+            if fresh:
+                seeds[m] = i
+                m += 1
+    k = m
+    clat = lat[seeds[:k]]
+    clon = lon[seeds[:k]]
+
+    labels = np.zeros(n, np.int32)
+    slat = np.empty(k, np.float64)
+    slon = np.empty(k, np.float64)
+    cnt = np.empty(k, np.int64)
+    for it in range(iters):
+        changed = assign_nearest(lat, lon, clat, clon, labels)
+        if it > 0 and not changed:
+            break
+        slat[:] = 0.0
+        slon[:] = 0.0
+        cnt[:] = 0
+        for i in range(n):
+            slat[labels[i]] += lat[i]
+            slon[labels[i]] += lon[i]
+            cnt[labels[i]] += 1
+        for c in range(k):
+            if cnt[c] > 0:
+                clat[c] = slat[c] / cnt[c]
+                clon[c] = slon[c] / cnt[c]
+    return labels
+
+def _warm_kernels():
+    pts = np.zeros(2, np.float32)
+    kmeans2d(pts, pts, 1, 1)
+
+assign_nearest = _assign_nearest
+kmeans2d = _kmeans2d
+
+if njit is not None:
+    assign_nearest = njit(cache=True, fastmath=True)(_assign_nearest)
+    kmeans2d = njit(cache=True, fastmath=True)(_kmeans2d)
+    # Compile (or load from numba's disk cache) off the main thread at import,
+    # so the first trip build doesn't pay for it.
+    threading.Thread(target=_warm_kernels, daemon=True).start()
+
+def projection_buckets(xy, k):
+    # Order stops along the origin -> destination axis and cut that order into
+    # k equal runs, so bucket ids follow travel order.
+    v = xy[-1] - xy[0]
+    t = (xy - xy[0]) @ v / (v @ v + 1e-9)
+    labels = np.empty(len(xy), np.int32)
+    for day, idx in enumerate(np.array_split(np.argsort(t, kind="stable"), k)):
+        labels[idx] = day
+    return labels
+
+def kmeans2d_numpy(xy, k, iters):
+    # Same seeding and Lloyd loop as kmeans2d, with every step a whole-array
+    # NumPy expression, for installs without numba.
+    n = len(xy)
+    order = np.concatenate([np.arange(0, n, max(1, n // k)), np.arange(n)])
+    _, first = np.unique(xy[order], axis=0, return_index=True)
+    centers = xy[order[np.sort(first)][:k]]
+    k = len(centers)
+    labels = np.full(len(xy), -1, np.intp)
+    for _ in range(iters):
+        d2 = ((xy[:, None, :] - centers[None, :, :]) ** 2).sum(-1)
+        new = d2.argmin(1)
+        if np.array_equal(new, labels):
+            break
+        labels = new
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, xy)
+        cnt = np.bincount(labels, minlength=k)
+        filled = cnt > 0
+        centers[filled] = sums[filled] / cnt[filled, None]
+    return labels.astype(np.int32)
+
+@st.cache_data(show_spinner=False)
+def cluster_labels(coords, days):
+    # float32 is ~1 m resolution at these magnitudes, plenty for day buckets.
+    xy = np.asarray(coords, dtype=np.float32)
+    k = min(days, len(xy))
+    if njit is not None:
+        lat, lon = np.ascontiguousarray(xy.T)
+        return kmeans2d(lat, lon, k, 20)
+
+    if len(xy) <= 50:
+        return projection_buckets(xy, k)
+    return kmeans2d_numpy(xy, k, 20)
+
+def cluster_route(route, days, pin_origin=True, pin_dest=True):
+    if len(route) == 0:
+        return route
+    if len(route) <= days:
+        # At most one stop per day: keep route order, nothing to cluster.
+        route["cluster"] = np.arange(len(route))
+        return route
+    if days == 1:
+        route["cluster"] = 0
+        return route
+    # Pin the origin and destination rows, when present, to the first and last
+    # day, cluster only the stops in between, and number those clusters by
+    # their position along the first -> last row axis.
+    head = 1 if pin_origin else 0
+    tail = len(route) - 1 if pin_dest else len(route)
+    xy = np.column_stack([route["lat"], route["lon"]])
+    inner = xy[head:tail]
+    labels = cluster_labels(tuple(map(tuple, inner)), days)
+    # Renumber to the clusters that actually hold stops, so an empty one
+    # can't claim a day number and leave that day blank.
+    _, labels = np.unique(labels, return_inverse=True)
+    axis = xy[-1] - xy[0]
+    t = (inner - xy[0]) @ axis / (axis @ axis + 1e-9)
+    k = int(labels.max()) + 1
+    mean_t = np.bincount(labels, weights=t, minlength=k) / np.bincount(labels)
+    rank = np.empty(k, np.int32)
+    rank[np.argsort(mean_t, kind="stable")] = np.arange(k)
+    route["cluster"][head:tail] = rank[labels]
+    if pin_origin:
+        route["cluster"][0] = 0
+    if pin_dest:
+        route["cluster"][-1] = days - 1
+    return route[np.argsort(route["cluster"], kind="stable")]